@@ -6,8 +6,11 @@
 # Global metrics table shown on all pages
 
 import os
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import dash
 from dash import dcc, html, Input, Output, dash_table
 
@@ -15,62 +18,111 @@ from dash import dcc, html, Input, Output, dash_table
 # Data Loading
 # ---------------------------------
 OUTPUT_DIR = "output"
-METRICS_CSV = os.path.join(OUTPUT_DIR, "trip_metrics.csv")
+METRICS_PARQUET = os.path.join(OUTPUT_DIR, "trip_metrics.parquet")
 
-df = pd.read_csv(METRICS_CSV) if os.path.exists(METRICS_CSV) else pd.DataFrame()
-
-NUMERIC_COLS = [
-    "duration_minutes",
-    "avg_speed",
-    "distance_km",
-    "max_speed",
-    "energy_consumed_kwh",
-]
+# Numeric dtypes are fixed by process_data.py and preserved by Parquet
+df = (
+    pd.read_parquet(METRICS_PARQUET, engine="pyarrow")
+    if os.path.exists(METRICS_PARQUET)
+    else pd.DataFrame()
+)
 
-for col in NUMERIC_COLS:
-    if col in df.columns:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
+# No file, or a column-less one when every row was rejected
+if "trip_id" not in df.columns:
+    df = pd.DataFrame(columns=["trip_id"])
 
 df = df.reset_index(drop=True)
+df["trip_id"] = df["trip_id"].astype("category")
 
 # Synthetic trip timeline
 df["trip_index"] = df.index + 1
 
+# Hash lookup for the trip callback; first row wins for duplicate ids
+TRIP_LOOKUP = df.drop_duplicates("trip_id").set_index("trip_id", drop=False)
+TRIP_IDS = pd.unique(df["trip_id"].dropna()).tolist()
+TRIP_OPTIONS = [{"label": t, "value": t} for t in TRIP_IDS]
+
 # ---------------------------------
 # Trip Clustering (for comparison page)
 # ---------------------------------
 CLUSTER_SIZE = 50
 
-def make_cluster_label(idx, total, size):
-    start = ((idx - 1) // size) * size + 1
-    end = min(start + size - 1, total)
-    return f"{start}-{end}"
-
 if not df.empty:
-    df["trip_cluster"] = df["trip_index"].apply(
-        lambda x: make_cluster_label(x, len(df), CLUSTER_SIZE)
+    # Bucket labels like "1-50", ordered by bucket start (not alphabetically)
+    n = len(df)
+    buckets = [
+        f"{s}-{min(s + CLUSTER_SIZE - 1, n)}"
+        for s in range(1, n + 1, CLUSTER_SIZE)
+    ]
+    idx = df["trip_index"].to_numpy()
+    df["trip_cluster"] = pd.Categorical.from_codes(
+        (idx - 1) // CLUSTER_SIZE, categories=buckets, ordered=True
     )
 
     clustered_df = (
-        df.groupby("trip_cluster", as_index=False)
-          .agg({
-              "avg_speed": "mean",
-              "distance_km": "mean",
-              "duration_minutes": "mean",
-          })
+        df.groupby("trip_cluster", as_index=False, observed=True, sort=False)
+          .agg(
+              avg_speed=("avg_speed", "mean"),
+              distance_km=("distance_km", "mean"),
+              duration_minutes=("duration_minutes", "mean"),
+          )
     )
 else:
     clustered_df = pd.DataFrame()
 
+# ---------------------------------
+# Fleet Statistics (data is fixed for the process, so compute once)
+# ---------------------------------
+FLEET_METRICS = ("avg_speed", "distance_km", "duration_minutes")
+
+def summarize(arr):
+    if arr.size == 0:
+        return {"n": 0, **dict.fromkeys(("mean", "median", "min", "max", "p25", "p75"), np.nan)}
+    p25, median, p75 = np.quantile(arr, [0.25, 0.5, 0.75])
+    return {
+        "n": int(arr.size),
+        "mean": round(float(arr.mean()), 2),
+        "median": round(float(median), 2),
+        "min": round(float(arr.min()), 2),
+        "max": round(float(arr.max()), 2),
+        "p25": round(float(p25), 2),
+        "p75": round(float(p75), 2),
+    }
+
+if not df.empty:
+    # NaN-free float32 arrays per metric; stats and box plots read from these
+    CLEAN_VIEWS = {m: df[m].dropna().to_numpy(np.float32) for m in FLEET_METRICS}
+
+    FLEET_STATS = {m: summarize(arr) for m, arr in CLEAN_VIEWS.items()}
+
+    FLEET_BOXPLOTS = {
+        m: px.box(
+            y=arr,
+            points="outliers",
+            labels={"y": m},
+            title=f"Fleet Distribution – {m.replace('_', ' ').title()}",
+        )
+        for m, arr in CLEAN_VIEWS.items()
+    }
+else:
+    CLEAN_VIEWS = {}
+    FLEET_STATS = {}
+    FLEET_BOXPLOTS = {}
+
 # ---------------------------------
 # App Init
 # ---------------------------------
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 app.title = "Vehicle Telematics Analytics"
 
+# WSGI entry point for production: gunicorn app:server (see gunicorn.conf.py)
+server = app.server
+
 # ---------------------------------
 # Helpers
 # ---------------------------------
+TABLE_PAGE_SIZE = 10
+
 def stat_card(label, value):
     return html.Div(
         style={
@@ -96,12 +148,16 @@ def metrics_table():
 
             dash_table.DataTable(
                 id="metrics-table",
-                data=df.to_dict("records"),
+                data=[],  # filled per page by update_table_page
                 columns=[
                     {"name": c.replace("_", " ").title(), "id": c}
                     for c in df.columns
                 ],
-                page_size=10,
+                # Server-side paging: only the visible page is sent
+                page_action="custom",
+                page_current=0,
+                page_size=TABLE_PAGE_SIZE,
+                page_count=max(1, -(-len(df) // TABLE_PAGE_SIZE)),
                 style_table={"overflowX": "auto"},
                 style_cell={
                     "textAlign": "center",
@@ -167,10 +223,7 @@ trip_layout = html.Div([
 
     dcc.Dropdown(
         id="trip-selector",
-        options=[
-            {"label": t, "value": t}
-            for t in df["trip_id"].dropna().unique()
-        ],
+        options=TRIP_OPTIONS,
         placeholder="Select Trip",
         style={"width": "320px"},
     ),
@@ -256,6 +309,18 @@ def route(pathname):
         return compare_layout
     return trip_layout
 
+# ---------------------------------
+# Metrics Table Paging Callback
+# ---------------------------------
+@app.callback(
+    Output("metrics-table", "data"),
+    Input("metrics-table", "page_current"),
+    Input("metrics-table", "page_size"),
+)
+def update_table_page(page_current, page_size):
+    start = (page_current or 0) * page_size
+    return df.iloc[start:start + page_size].to_dict("records")
+
 # ---------------------------------
 # Trip Deep Dive Callback
 # ---------------------------------
@@ -272,7 +337,7 @@ def update_trip(trip_id, trend_metric):
         empty = px.bar(title="Select a trip to begin")
         return [], empty, empty
 
-    t = df[df["trip_id"] == trip_id].iloc[0]
+    t = TRIP_LOOKUP.loc[trip_id]
 
     kpis = [
         stat_card("Duration (min)", round(t["duration_minutes"], 2)),
@@ -286,15 +351,20 @@ def update_trip(trip_id, trend_metric):
         title=f"Trip {trip_id} – Key Metrics",
     )
 
-    trend = px.line(
-        df,
-        x="trip_index",
-        y=trend_metric,
+    # WebGL trace with raw arrays: lighter payload than px.line for many trips
+    trend = go.Figure(go.Scattergl(
+        x=df["trip_index"].to_numpy(),
+        y=df[trend_metric].to_numpy(),
+        mode="lines",
+    ))
+    trend.update_layout(
         title=f"{trend_metric.replace('_', ' ').title()} Trend Across Trips",
+        xaxis_title="trip_index",
+        yaxis_title=trend_metric,
     )
 
     trend.add_vline(
-        x=t["trip_index"],
+        x=int(t["trip_index"]),
         line_dash="dash",
         annotation_text="Selected Trip",
     )
@@ -315,38 +385,26 @@ def update_fleet(metric):
         empty_fig = px.scatter(title="No data available")
         return [], empty_fig
 
-    dff = df[df[metric].notna()]
+    s = FLEET_STATS[metric]
 
     stats = [
-        stat_card("Trips", len(dff)),
-        stat_card("Mean", round(dff[metric].mean(), 2)),
-        stat_card("Median", round(dff[metric].median(), 2)),
-        stat_card("Min", round(dff[metric].min(), 2)),
-        stat_card("Max", round(dff[metric].max(), 2)),
-        stat_card("P25", round(dff[metric].quantile(0.25), 2)),
-        stat_card("P75", round(dff[metric].quantile(0.75), 2)),
+        stat_card("Trips", s["n"]),
+        stat_card("Mean", s["mean"]),
+        stat_card("Median", s["median"]),
+        stat_card("Min", s["min"]),
+        stat_card("Max", s["max"]),
+        stat_card("P25", s["p25"]),
+        stat_card("P75", s["p75"]),
     ]
 
-    boxplot = px.box(
-        dff,
-        y=metric,
-        points="outliers",
-        title=f"Fleet Distribution – {metric.replace('_', ' ').title()}",
-    )
-
-    return stats, boxplot
+    return stats, FLEET_BOXPLOTS[metric]
 
 # ---------------------------------
 # Clustered Comparison Callback
 # ---------------------------------
-@app.callback(
-    Output("compare-speed", "figure"),
-    Output("compare-distance", "figure"),
-    Output("compare-duration", "figure"),
-    Input("url", "pathname"),
-)
-def update_comparison(_):
-
+@lru_cache(maxsize=1)
+def _compare_figs():
+    # clustered_df never changes, so the figures are built once per process
     if clustered_df.empty:
         empty = px.scatter(title="No data available")
         return empty, empty, empty
@@ -377,6 +435,15 @@ def update_comparison(_):
 
     return speed, distance, duration
 
+@app.callback(
+    Output("compare-speed", "figure"),
+    Output("compare-distance", "figure"),
+    Output("compare-duration", "figure"),
+    Input("url", "pathname"),
+)
+def update_comparison(_):
+    return _compare_figs()
+
 # ---------------------------------
 # Run
 # ---------------------------------
@@ -0,0 +1,10 @@
+# gunicorn.conf.py – production server settings for the dashboard
+# Run with: gunicorn app:server
+# Listens on localhost only, like the dev server; to expose the dashboard
+# (it has no authentication) pass e.g. --bind 0.0.0.0:8050
+
+bind = "127.0.0.1:8050"
+workers = 4
+threads = 2
+worker_class = "gthread"
+timeout = 120
@@ -3,14 +3,33 @@
 import pandas as pd
 import numpy as np
 import os
+import csv
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
+
+try:
+    from numba import njit
+except ImportError:  # optional: the trip delta kernel then runs as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+try:
+    import polars as pl
+except ImportError:  # optional: only used for very large trip-level files
+    pl = None
 
 # ---------------------------------
 # Configuration
 # ---------------------------------
 CSV_PATH = "vehicle_telematics.csv"
 CHUNK_SIZE = 100_000
+ARROW_BLOCK_SIZE = 1 << 24  # 16 MiB per parse block
+POLARS_MIN_BYTES = 500 * 1024 * 1024  # trip-level files above this use Polars
 GAP_THRESHOLD_SEC = 300  # 5 minutes
 OUTPUT_DIR = "output"
+CLEANED_PATH = f"{OUTPUT_DIR}/cleaned_telematics.parquet"
+REJECTED_PATH = f"{OUTPUT_DIR}/rejected_telematics.parquet"
 
 REQUIRED_COLUMNS = {
     "trip_id",
@@ -32,6 +51,34 @@ VALID_RANGES = {
     "cell_temp_c": (-40, 100),
 }
 
+# Range bounds as vectors so one (rows, sensors) comparison covers every column
+SENSOR_COLUMNS = list(VALID_RANGES)
+RANGE_LO = np.array([lo for lo, _ in VALID_RANGES.values()], dtype=np.float32)
+RANGE_HI = np.array([hi for _, hi in VALID_RANGES.values()], dtype=np.float32)
+
+# Validation outcomes are tracked as bit flags and decoded to "|reason" notes
+REJECTION_FLAGS = {
+    "missing_trip_id": 1,
+    "invalid_timestamp": 2,
+    "all_sensors_invalid": 4,
+}
+
+SALVAGE_FLAGS = {
+    f"{col}_out_of_range": 1 << i for i, col in enumerate(VALID_RANGES)
+}
+SALVAGE_BITS = np.array(list(SALVAGE_FLAGS.values()), dtype=np.uint16)
+
+# Trip-level output column -> source column in the aggregated CSV
+TRIP_LEVEL_METRICS = {
+    "duration_minutes": "duration_minutes",
+    "avg_speed": "speed_avg",
+    "distance_km": "distance_km",
+    "max_speed": "speed_max",
+    "max_motor_temp": "motor_temp_max",
+    "max_cell_temp": "cell_temp_max",
+    "energy_consumed_kwh": "energy_consumed_kwh",
+}
+
 COLUMN_ALIASES = {
     "trip_id": ["trip_id", "tripid", "vehicle_id", "vehicleid"],
     "timestamp": ["timestamp", "time", "utc_timestamp", "datetime"],
@@ -50,19 +97,176 @@ def normalize_columns(df):
     df.columns = df.columns.str.strip().str.lower()
     return df
 
-def resolve_columns(df):
+def resolve_rename_map(columns):
     rename_map = {}
     for canonical, aliases in COLUMN_ALIASES.items():
-        for col in df.columns:
+        for col in columns:
             if col in aliases:
                 rename_map[col] = canonical
                 break
-    return df.rename(columns=rename_map)
+    return rename_map
+
+def resolve_columns(df):
+    return df.rename(columns=resolve_rename_map(df.columns))
 
-def coerce_float(series):
-    return pd.to_numeric(series, errors="coerce")
+def coerce_float(series, dtype=np.float32):
+    # float32 covers every sensor range here at half the memory traffic;
+    # displayed trip metrics ask for float64
+    return pd.to_numeric(series, errors="coerce").astype(dtype)
 
-def is_trip_level_schema(df):
+def decode_flags(flags, flag_names):
+    """
+    Turn a flag bitmask array into "|reason|reason" strings ("" when unset).
+    """
+    notes = np.full(len(flags), "", dtype=object)
+    flagged = flags != 0
+    notes[flagged] = [
+        "".join(f"|{name}" for name, bit in flag_names.items() if f & bit)
+        for f in flags[flagged]
+    ]
+    return notes
+
+def output_schema(columns):
+    """
+    Arrow schema for the cleaned/rejected outputs, fixed by column name.
+    Inferring it from the first chunk would type an all-blank text column
+    as null and break on the first later chunk that has a value.
+    Everything besides sensors and timestamp is read as text, so it stays text.
+    """
+    fields = []
+    for col in columns:
+        if col in VALID_RANGES:
+            fields.append(pa.field(col, pa.float32()))
+        elif col == "timestamp":
+            fields.append(pa.field(col, pa.timestamp("ns", tz="UTC")))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+def write_parquet_part(writer, df, path):
+    """
+    Append df to the Parquet file at path as one row group.
+    Opens the writer on first use.
+    """
+    if writer is None:
+        writer = pq.ParquetWriter(path, output_schema(df.columns), compression="zstd")
+    writer.write_table(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+    return writer
+
+def close_parquet(writer, path):
+    # Outputs are always persisted, even when no rows landed in them
+    if writer is None:
+        pd.DataFrame().to_parquet(path, index=False)
+    else:
+        writer.close()
+
+def canonical_name(col):
+    col = col.strip().lower()
+    for canonical, aliases in COLUMN_ALIASES.items():
+        if col in aliases:
+            return canonical
+    return col
+
+def arrow_column_types(raw_columns):
+    """
+    Explicit Arrow types for the known fields, keyed by raw CSV header.
+    Sensors and timestamps are read as text: bad or naive values must reach
+    coerce_float / to_datetime instead of failing the read.
+    """
+    known = set(VALID_RANGES) | {"timestamp", "trip_id"}
+    return {
+        raw: pa.string()
+        for raw in raw_columns
+        if canonical_name(raw) in known
+    }
+
+def read_csv_header(path):
+    # utf-8-sig drops a BOM (Excel "CSV UTF-8") the same way Arrow does,
+    # so these names match the parser's column names
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f))
+
+def read_csv_table(path, raw_columns):
+    """
+    Parse the CSV with Arrow's multithreaded reader in a single pass.
+    Other columns are type-inferred; the table reader widens a column to
+    text when a later block does not fit the first guess.
+    """
+    return pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=ARROW_BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(
+            column_types=arrow_column_types(raw_columns),
+            strings_can_be_null=True,
+        ),
+    )
+
+def iter_chunks(path, raw_columns):
+    """
+    Stream the CSV block by block and yield pandas chunks of at most
+    CHUNK_SIZE rows, so memory stays bounded by one block plus one chunk.
+    Every column is read as text: a streaming reader cannot widen a type
+    after the first block, and it fixes the output schema up front.
+    """
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=ARROW_BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(
+            column_types={raw: pa.string() for raw in raw_columns},
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        for start in range(0, batch.num_rows, CHUNK_SIZE):
+            yield batch.slice(start, CHUNK_SIZE).to_pandas()
+
+def read_trip_level_polars(path, raw_columns):
+    """
+    Lazy Polars scan for large trip-level files.
+    Streams the cleaned rows to Parquet, then collects only the columns
+    needed for trip metrics, as pandas.
+    """
+    normalized = [c.strip().lower() for c in raw_columns]
+    rename_map = resolve_rename_map(normalized)
+    names = [rename_map.get(c, c) for c in normalized]
+
+    # trip_id as text and date strings as datetimes, same as the Arrow path
+    cleaned = (
+        pl.scan_csv(path, try_parse_dates=True)
+        .rename(dict(zip(raw_columns, names)))
+        .filter(pl.col("trip_id").is_not_null())
+        .with_columns(pl.col("trip_id").cast(pl.Utf8))
+    )
+    cleaned.sink_parquet(CLEANED_PATH, compression="zstd")
+
+    wanted = ["trip_id"] + [c for c in TRIP_LEVEL_METRICS.values() if c in names]
+    return cleaned.select(wanted).collect().to_pandas()
+
+@njit(cache=True)
+def accumulate_trip_deltas(codes, ts_ns, speed, n_groups, gap_threshold_sec):
+    """
+    Single pass over rows sorted by (trip, timestamp).
+    Returns per-trip duration (s), distance (km) and gap count.
+    """
+    duration_sec = np.zeros(n_groups)
+    distance_km = np.zeros(n_groups)
+    gap_count = np.zeros(n_groups, np.int64)
+
+    for i in range(1, len(codes)):
+        g = codes[i]
+        if g != codes[i - 1]:
+            continue
+        dt = (ts_ns[i] - ts_ns[i - 1]) / 1e9
+        if dt < 0:
+            dt = 0.0
+        duration_sec[g] += dt
+        distance_km[g] += speed[i] * dt / 3600
+        if dt > gap_threshold_sec:
+            gap_count[g] += 1
+
+    return duration_sec, distance_km, gap_count
+
+def is_trip_level_schema(columns):
     """
     Detect already-aggregated trip-level data.
     """
@@ -73,7 +277,7 @@ def is_trip_level_schema(df):
         "speed_max",
         "energy_consumed_kwh",
     }
-    return bool(trip_level_signals.intersection(set(df.columns)))
+    return bool(trip_level_signals.intersection(set(columns)))
 
 # ---------------------------------
 # Sanity check CSV
@@ -84,40 +288,45 @@ if not os.path.exists(CSV_PATH):
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # ---------------------------------
-# Read first chunk to detect schema
+# Read CSV and detect schema
 # ---------------------------------
-reader = pd.read_csv(CSV_PATH, chunksize=CHUNK_SIZE)
-first_chunk = next(reader)
-first_chunk = normalize_columns(first_chunk)
+RAW_COLUMNS = read_csv_header(CSV_PATH)
 
-IS_TRIP_LEVEL = is_trip_level_schema(first_chunk)
+IS_TRIP_LEVEL = is_trip_level_schema(c.strip().lower() for c in RAW_COLUMNS)
 
 # ---------------------------------
 # TRIP-LEVEL DATA PATH (FIX)
 # ---------------------------------
 if IS_TRIP_LEVEL:
-    df = first_chunk
-    for chunk in reader:
-        chunk = normalize_columns(chunk)
-        df = pd.concat([df, chunk], ignore_index=True)
+    df = None
+
+    if pl is not None and os.path.getsize(CSV_PATH) > POLARS_MIN_BYTES:
+        try:
+            df = read_trip_level_polars(CSV_PATH, RAW_COLUMNS)
+        except pl.exceptions.PolarsError:
+            df = None  # e.g. type inference mismatch; use the Arrow path
 
-    df = resolve_columns(df)
+    if df is None:
+        df = normalize_columns(read_csv_table(CSV_PATH, RAW_COLUMNS).to_pandas(self_destruct=True))
 
-    df = df[df["trip_id"].notna()]
+        df = resolve_columns(df)
+
+        df = df[df["trip_id"].notna()]
+
+        df.to_parquet(CLEANED_PATH, compression="zstd", index=False)
 
     trip_metrics_df = pd.DataFrame({
         "trip_id": df["trip_id"],
-        "duration_minutes": df.get("duration_minutes"),
-        "avg_speed": df.get("speed_avg"),
-        "distance_km": df.get("distance_km"),
-        "max_speed": df.get("speed_max"),
-        "max_motor_temp": df.get("motor_temp_max"),
-        "max_cell_temp": df.get("cell_temp_max"),
-        "energy_consumed_kwh": df.get("energy_consumed_kwh"),
+        **{out: df.get(src) for out, src in TRIP_LEVEL_METRICS.items()},
     })
 
-    trip_metrics_df.to_csv(f"{OUTPUT_DIR}/trip_metrics.csv", index=False)
-    df.to_csv(f"{OUTPUT_DIR}/cleaned_telematics.csv", index=False)
+    # Fix numeric dtypes here so the Parquet file carries them to the dashboard
+    for col in trip_metrics_df.columns.drop("trip_id"):
+        trip_metrics_df[col] = coerce_float(trip_metrics_df[col], np.float64)
+
+    trip_metrics_df.to_parquet(
+        f"{OUTPUT_DIR}/trip_metrics.parquet", engine="pyarrow", compression="snappy", index=False
+    )
 
     print("=== Processing Complete ===")
     print("Trip-level data detected")
@@ -128,13 +337,13 @@ if IS_TRIP_LEVEL:
 # ---------------------------------
 # TIME-SERIES DATA PATH (ORIGINAL)
 # ---------------------------------
-validated_rows = []
-rejected_rows = []
+cleaned_writer = None
+rejected_writer = None
 total_rows_read = 0
+total_valid_rows = 0
+total_rejected_rows = 0
 
-chunks = [first_chunk] + list(reader)
-
-for chunk in chunks:
+for chunk in iter_chunks(CSV_PATH, RAW_COLUMNS):
     total_rows_read += len(chunk)
 
     chunk = normalize_columns(chunk)
@@ -143,88 +352,140 @@ for chunk in chunks:
     # Ensure all required columns exist
     for col in REQUIRED_COLUMNS:
         if col not in chunk.columns:
-            chunk[col] = np.nan
+            chunk[col] = None
 
-    chunk["rejection_reasons"] = ""
-    chunk["salvage_notes"] = ""
-    chunk["validation_status"] = "valid"
+    rejection = np.zeros(len(chunk), np.uint8)
+    salvage = np.zeros(len(chunk), np.uint16)
 
     # Timestamp parsing
-    chunk["timestamp"] = pd.to_datetime(chunk["timestamp"], errors="coerce", utc=True)
+    # ISO-8601 keeps pandas on its C parser instead of per-string dateutil
+    chunk["timestamp"] = pd.to_datetime(
+        chunk["timestamp"], errors="coerce", utc=True, format="ISO8601", cache=True
+    )
 
     # Numeric coercion
     for col in VALID_RANGES:
         chunk[col] = coerce_float(chunk[col])
 
     # Hard rejects
-    chunk.loc[chunk["trip_id"].isna(), "rejection_reasons"] += "|missing_trip_id"
-    chunk.loc[chunk["timestamp"].isna(), "rejection_reasons"] += "|invalid_timestamp"
+    rejection[chunk["trip_id"].isna().to_numpy()] |= REJECTION_FLAGS["missing_trip_id"]
+    rejection[chunk["timestamp"].isna().to_numpy()] |= REJECTION_FLAGS["invalid_timestamp"]
 
     # Sensor validation (partial salvage)
-    for col, (lo, hi) in VALID_RANGES.items():
-        invalid = ~chunk[col].between(lo, hi)
-        chunk.loc[invalid, col] = np.nan
-        chunk.loc[invalid, "salvage_notes"] += f"|{col}_out_of_range"
+    # Missing values fail both comparisons, so they count as invalid like before
+    sensors = chunk[SENSOR_COLUMNS].to_numpy(dtype=np.float32)
+    invalid = ~((sensors >= RANGE_LO) & (sensors <= RANGE_HI))
+    sensors[invalid] = np.nan
+    for j, col in enumerate(SENSOR_COLUMNS):
+        chunk[col] = sensors[:, j]
+    salvage |= np.bitwise_or.reduce(invalid * SALVAGE_BITS, axis=1)
 
     # Fully invalid sensor rows
-    all_nan = chunk[list(VALID_RANGES.keys())].isna().all(axis=1)
-    chunk.loc[all_nan, "rejection_reasons"] += "|all_sensors_invalid"
+    rejection[invalid.all(axis=1)] |= REJECTION_FLAGS["all_sensors_invalid"]
 
     # Final classification
-    rejected_mask = chunk["rejection_reasons"] != ""
-    chunk.loc[rejected_mask, "validation_status"] = "rejected"
+    rejected_mask = rejection != 0
+    chunk["rejection_reasons"] = decode_flags(rejection, REJECTION_FLAGS)
+    chunk["salvage_notes"] = decode_flags(salvage, SALVAGE_FLAGS)
+    chunk["validation_status"] = np.where(rejected_mask, "rejected", "valid")
+
+    # Stream each part straight to its dataset instead of holding it in RAM
+    n_rejected = int(rejected_mask.sum())
+    if n_rejected < len(chunk):
+        cleaned_writer = write_parquet_part(cleaned_writer, chunk[~rejected_mask], CLEANED_PATH)
+    if n_rejected:
+        rejected_writer = write_parquet_part(rejected_writer, chunk[rejected_mask], REJECTED_PATH)
 
-    validated_rows.append(chunk[~rejected_mask])
-    rejected_rows.append(chunk[rejected_mask])
+    total_valid_rows += len(chunk) - n_rejected
+    total_rejected_rows += n_rejected
 
 # ---------------------------------
-# Explicit Intermediate Datasets
+# Explicit Intermediate Datasets (ALWAYS)
 # ---------------------------------
-cleaned_df = pd.concat(validated_rows, ignore_index=True) if validated_rows else pd.DataFrame()
-rejected_df = pd.concat(rejected_rows, ignore_index=True) if rejected_rows else pd.DataFrame()
+close_parquet(cleaned_writer, CLEANED_PATH)
+close_parquet(rejected_writer, REJECTED_PATH)
 
 # ---------------------------------
 # Time-Series Processing
 # ---------------------------------
-metrics = []
-
-if not cleaned_df.empty:
-    for trip_id, g in cleaned_df.groupby("trip_id"):
-        g = g.sort_values("timestamp")
-
-        g["dt_sec"] = g["timestamp"].diff().dt.total_seconds().clip(lower=0)
-        g["is_gap"] = g["dt_sec"] > GAP_THRESHOLD_SEC
-
-        duration_sec = g["dt_sec"].sum()
-        distance_km = (g["speed_kmph"].fillna(0) * g["dt_sec"].fillna(0) / 3600).sum()
-
-        metrics.append({
-            "trip_id": trip_id,
-            "rows": len(g),
-            "duration_minutes": duration_sec / 60,
-            "gap_count": int(g["is_gap"].sum()),
-            "max_speed": g["speed_kmph"].max(skipna=True),
-            "avg_speed": g["speed_kmph"].mean(skipna=True),
-            "distance_km": distance_km,
-            "max_motor_temp": g["motor_temp_c"].max(skipna=True),
-            "max_cell_temp": g["cell_temp_c"].max(skipna=True),
-            "min_battery_voltage": g["battery_voltage"].min(skipna=True),
-            "max_current": g["battery_current"].max(skipna=True),
-        })
-
-final_metrics_df = pd.DataFrame(metrics)
+if total_valid_rows:
+    # Read back only the columns the metrics need
+    cleaned_df = pq.read_table(
+        CLEANED_PATH,
+        columns=[
+            "trip_id",
+            "timestamp",
+            "speed_kmph",
+            "battery_voltage",
+            "battery_current",
+            "motor_temp_c",
+            "cell_temp_c",
+        ],
+    ).to_pandas(self_destruct=True)
+
+    # Aggregate in float64; sensors stay float32 only in the row-level outputs
+    sensor_cols = ["speed_kmph", "battery_voltage", "battery_current", "motor_temp_c", "cell_temp_c"]
+    cleaned_df[sensor_cols] = cleaned_df[sensor_cols].astype(np.float64)
+
+    # trip_id is text, so sorting on it would put "10" before "2". Order trips
+    # by first appearance instead, then by timestamp within each trip; deltas
+    # are then accumulated in a single compiled pass
+    codes, trip_ids = pd.factorize(cleaned_df["trip_id"], sort=False)
+    ts_ns = cleaned_df["timestamp"].to_numpy(dtype="datetime64[ns]").view("i8")
+    order = np.lexsort((ts_ns, codes))
+    cleaned_df = cleaned_df.iloc[order].reset_index(drop=True)
+    codes = codes[order]
+    ts_ns = ts_ns[order]
+    speed = cleaned_df["speed_kmph"].fillna(0).to_numpy()
+
+    duration_sec, distance_km, gap_count = accumulate_trip_deltas(
+        codes, ts_ns, speed, len(trip_ids), GAP_THRESHOLD_SEC
+    )
+
+    # groupby(sort=False) keeps first-appearance order, matching factorize codes
+    final_metrics_df = (
+        cleaned_df.groupby("trip_id", sort=False)
+        .agg(
+            rows=("timestamp", "size"),
+            max_speed=("speed_kmph", "max"),
+            avg_speed=("speed_kmph", "mean"),
+            max_motor_temp=("motor_temp_c", "max"),
+            max_cell_temp=("cell_temp_c", "max"),
+            min_battery_voltage=("battery_voltage", "min"),
+            max_current=("battery_current", "max"),
+        )
+        .reset_index()
+    )
+    final_metrics_df.insert(2, "duration_minutes", duration_sec / 60)
+    final_metrics_df.insert(3, "gap_count", gap_count)
+    final_metrics_df.insert(6, "distance_km", distance_km)
+
+    # Max/min are exact float32 readings; going through their shortest
+    # decimal form stores 45.2 as 45.2 rather than 45.20000076...
+    exact_metrics = [
+        "max_speed",
+        "max_motor_temp",
+        "max_cell_temp",
+        "min_battery_voltage",
+        "max_current",
+    ]
+    final_metrics_df[exact_metrics] = (
+        final_metrics_df[exact_metrics].astype(np.float32).astype(str).astype(np.float64)
+    )
+else:
+    final_metrics_df = pd.DataFrame()
 
 # ---------------------------------
 # Persist Outputs (ALWAYS)
 # ---------------------------------
-cleaned_df.to_csv(f"{OUTPUT_DIR}/cleaned_telematics.csv", index=False)
-rejected_df.to_csv(f"{OUTPUT_DIR}/rejected_telematics.csv", index=False)
-final_metrics_df.to_csv(f"{OUTPUT_DIR}/trip_metrics.csv", index=False)
+final_metrics_df.to_parquet(
+    f"{OUTPUT_DIR}/trip_metrics.parquet", engine="pyarrow", compression="snappy", index=False
+)
 
 print("=== Processing Complete ===")
 print(f"Total rows read     : {total_rows_read}")
-print(f"Valid rows          : {len(cleaned_df)}")
-print(f"Rejected rows       : {len(rejected_df)}")
+print(f"Valid rows          : {total_valid_rows}")
+print(f"Rejected rows       : {total_rejected_rows}")
 print(f"Output directory    : {OUTPUT_DIR}/")
 
 